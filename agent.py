@@ -10,19 +10,42 @@ Step 10: Plan-and-Execute（规划与执行）
    - 规划阶段不给工具：强迫 LLM 先思考全局，而不是立刻行动
 """
 
+import argparse
 import time
-import anthropic as anthropic_lib
-from anthropic import Anthropic
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from tools import get_all_tools, execute_tool
+from result_store import default_store, preview
+from approval import ApprovalPolicy
+from renderer import Renderer, get_renderer, set_renderer
+from token_counter import TokenCounter, ContextTooLargeError
+from planner import PlanExecutor, parse_plan
 from config import ANTHROPIC_API_KEY
 
 
+# ============================================================
+# ⭐ 核心竞争力 ⑧ Cost & Latency（启动速度）
+#
+# anthropic SDK、concurrent.futures、tools.py 都延迟到第一次使用时才导入：
+#   - anthropic SDK 依赖 httpx / pydantic 等，import 一次就要几百毫秒
+#   - 短的脚本调用（python agent.py "任务" --quiet）大部分时间都花在启动上
+# 用 bench_startup.py 检查启动耗时，防止有人又把重型 import 放回顶层
+# ============================================================
+
+def _anthropic():
+    """延迟导入 anthropic SDK（sys.modules 有缓存，重复调用几乎没有开销）"""
+    import anthropic
+    return anthropic
+
+
 class Agent:
-    def __init__(self, max_turns: int = 10):
-        self.client = Anthropic(api_key=ANTHROPIC_API_KEY)
+    def __init__(self, max_turns: int = 10, approval_policy: ApprovalPolicy = None,
+                 renderer: Renderer = None, max_parallel_steps: int = 4):
+        self._client = None
         self.model = "claude-sonnet-4-20250514"
         self.max_turns = max_turns
+        self.max_parallel_steps = max_parallel_steps
+        self.approval_policy = approval_policy or ApprovalPolicy()
+        self.renderer = renderer or get_renderer()
+        # 预检压缩掉的工具结果存进结果存储，之后仍可用 fetch_result 取回
+        self.token_counter = TokenCounter(store=default_store)
 
         self.system_prompt = """你是一个编程助手。你可以帮助用户：
 - 阅读和分析代码文件
@@ -36,10 +59,17 @@ class Agent:
 
         self.conversation_history = []
 
+    @property
+    def client(self):
+        """第一次调用 LLM 时才创建客户端（同时才导入 anthropic SDK）"""
+        if self._client is None:
+            self._client = _anthropic().Anthropic(api_key=ANTHROPIC_API_KEY)
+        return self._client
+
     def run(self, user_message: str) -> None:
         """运行 Agent 处理用户消息（Plan-and-Execute）"""
-        self._print_header("用户输入")
-        print(f"  {user_message}")
+        self.renderer.header("用户输入")
+        self.renderer.log(f"  {user_message}")
 
         # ============================================================
         # ⭐ 核心竞争力 ⑤ Planning & Reasoning
@@ -51,30 +81,61 @@ class Agent:
         # Phase 2: 执行阶段
         #   - 把计划注入对话历史，执行 LLM 看到自己"制定"的计划
         #   - 有了全局视角，不容易做多余的事或丢失原始目标
+        #   - 计划里有互不依赖的步骤时，先由并行 Worker 执行，结果再汇总回来
         # ============================================================
 
         # --- Phase 1: 规划 ---
-        self._print_header("规划阶段")
-        print("\n  >>> 生成执行计划（纯推理，不调用工具）...\n")
-        plan = self._create_plan(user_message)
+        self.renderer.header("规划阶段")
+        self.renderer.log("\n  >>> 生成执行计划（纯推理，不调用工具）...\n")
+        plan_text = self._create_plan(user_message)
+        plan = parse_plan(plan_text)
+        if plan is not None:
+            self.renderer.log(plan.to_text(), kind="plan")
+            if not plan.is_parallel():
+                self.renderer.log("\n  [计划] 步骤之间依次依赖，按顺序执行")
+        else:
+            self.renderer.log(plan_text, kind="plan")
+            self.renderer.log("\n  [计划] 无法解析为结构化计划，退回顺序执行", kind="warning")
 
-        # 将计划注入对话：user 提问 → assistant 给出计划 → user 说"请执行"
-        # 执行阶段的 LLM 看到自己"说过"这个计划，会倾向于遵循它
         self.conversation_history.append({"role": "user", "content": user_message})
-        self.conversation_history.append({"role": "assistant", "content": f"我的执行计划：\n\n{plan}"})
-        self.conversation_history.append({"role": "user", "content": "好，请严格按照计划执行，完成后汇报最终结果。"})
+
+        if plan is not None and plan.is_parallel():
+            # --- Phase 1.5: 并行执行互不依赖的步骤 ---
+            step_results, failed = self._execute_plan(plan, user_message)
+
+            # 将计划和各步骤结果注入对话，Orchestrator 负责补完和汇总
+            report = "\n\n".join(
+                f"[{step.id}] {step.task}\n{'失败' if step.id in failed else '结果'}："
+                f"{default_store.spill(step_results[step.id])}"
+                for step in plan.steps
+            )
+            self.conversation_history.append({
+                "role": "assistant",
+                "content": f"我的执行计划：\n\n{plan.to_text()}\n\n各步骤已并行执行，结果如下：\n\n{report}"
+            })
+            self.conversation_history.append({
+                "role": "user",
+                "content": "好，请检查各步骤结果，重新完成失败的步骤和未能完成的操作（如被拒绝的写入或执行），然后汇报最终结果。"
+            })
+        else:
+            # 将计划注入对话：user 提问 → assistant 给出计划 → user 说"请执行"
+            # 执行阶段的 LLM 看到自己"说过"这个计划，会倾向于遵循它
+            plan_for_history = plan.to_text() if plan is not None else plan_text
+            self.conversation_history.append({"role": "assistant", "content": f"我的执行计划：\n\n{plan_for_history}"})
+            self.conversation_history.append({"role": "user", "content": "好，请严格按照计划执行，完成后汇报最终结果。"})
 
         # --- Phase 2: 执行 ---
-        self._print_header("执行阶段")
+        self.renderer.header("执行阶段")
+        anthropic_lib = _anthropic()
 
         turn = 0
         while turn < self.max_turns:
             turn += 1
 
-            self._print_header(f"第 {turn} 轮")
-            self._print_messages_summary(self.conversation_history)
+            self.renderer.header(f"第 {turn} 轮")
+            self.renderer.messages_summary(self.conversation_history)
 
-            print("\n  >>> 调用 LLM（流式）...\n")
+            self.renderer.log("\n  >>> 调用 LLM（流式）...\n")
 
             # ============================================================
             # ⭐ 核心竞争力 ⑩ User Experience
@@ -86,27 +147,32 @@ class Agent:
             try:
                 response = self._call_llm_with_retry(self.conversation_history)
             except anthropic_lib.RateLimitError:
-                self._print_header("错误")
-                print("  API 限流，重试次数耗尽，请稍后再试。")
+                self.renderer.header("错误")
+                self.renderer.log("  API 限流，重试次数耗尽，请稍后再试。", kind="error")
                 return
             except anthropic_lib.APIConnectionError:
-                self._print_header("错误")
-                print("  网络连接失败，请检查网络后重试。")
+                self.renderer.header("错误")
+                self.renderer.log("  网络连接失败，请检查网络后重试。", kind="error")
                 return
             except anthropic_lib.AuthenticationError:
-                self._print_header("错误")
-                print("  API Key 无效，请检查 config.py 中的配置。")
+                self.renderer.header("错误")
+                self.renderer.log("  API Key 无效，请检查 config.py 中的配置。", kind="error")
+                return
+            except ContextTooLargeError as e:
+                self.renderer.header("错误")
+                self.renderer.log(f"  上下文过大，已拒绝发送：{str(e)}", kind="error")
+                self.renderer.log("  请输入 reset 清空对话后重试。", kind="error")
                 return
             except anthropic_lib.BadRequestError as e:
-                self._print_header("错误")
-                print(f"  请求出错：{str(e)}")
+                self.renderer.header("错误")
+                self.renderer.log(f"  请求出错：{str(e)}", kind="error")
                 return
             except Exception as e:
-                self._print_header("错误")
-                print(f"  未知错误：{str(e)}")
+                self.renderer.header("错误")
+                self.renderer.log(f"  未知错误：{str(e)}", kind="error")
                 return
 
-            print(f"\n  <<< 流式完成 (stop_reason: {response.stop_reason})")
+            self.renderer.log(f"\n  <<< 流式完成 (stop_reason: {response.stop_reason})")
             self._print_response_content(response)
 
             if response.stop_reason == "end_turn":
@@ -114,27 +180,33 @@ class Agent:
                     "role": "assistant",
                     "content": response.content
                 })
+                # quiet / json 模式下，最终回答在这里统一输出
+                self.renderer.final("".join(b.text for b in response.content if b.type == "text"))
 
-                self._print_header("循环结束")
-                print(f"  共执行 {turn} 轮")
+                self.renderer.header("循环结束")
+                self.renderer.log(f"  共执行 {turn} 轮")
                 return
 
             elif response.stop_reason == "tool_use":
-                print("\n  --- 执行工具 ---")
+                self.renderer.log("\n  --- 执行工具 ---")
                 self._process_tool_calls(self.conversation_history, response)
-                print("  --- 工具执行完毕，继续下一轮 ---")
+                self.renderer.log("  --- 工具执行完毕，继续下一轮 ---")
 
             else:
-                print(f"\n  [!] 意外的 stop_reason: {response.stop_reason}")
+                self.renderer.log(f"\n  [!] 意外的 stop_reason: {response.stop_reason}", kind="warning")
                 return
 
-        self._print_header("警告")
-        print(f"  达到最大轮次 {self.max_turns}，强制退出")
+        self.renderer.header("警告")
+        self.renderer.log(f"  达到最大轮次 {self.max_turns}，强制退出", kind="warning")
 
     def reset(self):
         """清空对话历史，开始新对话"""
         self.conversation_history = []
-        print("[对话历史已清空]")
+        default_store.clear()
+        # token 缓存持有消息引用，不清理的话旧会话（含大工具结果）会一直留在内存里
+        self.token_counter.forget([])
+        self.renderer.reset_summary()
+        self.renderer.log("[对话历史已清空]")
 
     def _create_plan(self, user_message: str) -> str:
         """
@@ -146,23 +218,56 @@ class Agent:
         """
         planning_messages = [{
             "role": "user",
-            "content": f"请为以下任务制定简洁的执行计划（编号列表，不要执行，只列步骤）：\n\n{user_message}"
+            "content": (
+                "请为以下任务制定简洁的执行计划，不要执行。只输出一个 JSON 对象，格式：\n"
+                '{"steps": [{"id": "s1", "task": "步骤描述（能独立执行）", "depends_on": []}]}\n'
+                "互不依赖的步骤（例如分别审查两个模块）不要互相依赖，以便并行执行；"
+                "需要用到其他步骤结果的步骤，在 depends_on 中列出那些步骤的 id。\n\n"
+                f"任务：{user_message}"
+            )
         }]
 
         plan_text = ""
         with self.client.messages.stream(
             model=self.model,
-            max_tokens=512,
-            system="你是一个任务规划助手。将用户任务分解为清晰的执行步骤。只输出步骤列表，简洁明了，不执行任何操作。",
+            max_tokens=1024,
+            system="你是一个任务规划助手。将用户任务分解为清晰的执行步骤，并标明步骤之间的依赖关系。只输出 JSON，不执行任何操作。",
             messages=planning_messages
             # 注意：故意不传 tools，强迫 LLM 纯推理
         ) as stream:
+            # 计划是 JSON，逐 token 打印原始 JSON 没有可读性
+            # 这里只收集文字，解析后由 run() 打印编号列表
             for text in stream.text_stream:
-                print(text, end="", flush=True)
                 plan_text += text
-        print()
         return plan_text
 
+    def _execute_plan(self, plan, user_message: str) -> tuple:
+        """
+        并行执行计划中的步骤，返回 (step_id → 结果, 失败的 step_id 集合)
+
+        ⭐ 核心竞争力 ⑧ Cost & Latency
+           - 依赖都完成的步骤立即交给独立的 Worker（有界线程池）
+           - 每个 Worker 有独立上下文，只看到原始任务、本步骤和依赖步骤的结果
+           - 总耗时 ≈ 关键路径长度，而不是步骤数
+        """
+        self.renderer.header("并行执行计划步骤")
+        self.renderer.log(
+            f"  共 {len(plan.steps)} 个步骤，关键路径 {plan.depth()} 步，"
+            f"最多 {self.max_parallel_steps} 个 Worker 并行"
+        )
+
+        start = time.monotonic()
+        executor = PlanExecutor(plan, user_message, self.approval_policy,
+                                max_workers=self.max_parallel_steps)
+        results = executor.run()
+
+        for step in plan.steps:
+            status = "步骤失败" if step.id in executor.failed else "步骤完成"
+            self.renderer.log(f"\n  [{status}] {step.id}: {step.task}")
+            self.renderer.log(f"      结果: {preview(results[step.id]).replace(chr(10), chr(10) + '      ')}")
+        self.renderer.log(f"\n  并行执行耗时 {time.monotonic() - start:.1f}s")
+        return results, executor.failed
+
     # ============================================================
     # ⭐ 核心竞争力 ⑩ User Experience（Step 8 核心改动）
     #
@@ -177,20 +282,41 @@ class Agent:
 
     def _call_llm_with_retry(self, messages: list):
         """调用 LLM（流式），遇到可重试错误时自动重试（指数退避）"""
+        from tools import get_all_tools
+
+        anthropic_lib = _anthropic()
         max_retries = 3
+        max_tokens = 4096
+        tools = get_all_tools()
+
+        # ⭐ 核心竞争力 ① Context Management
+        # 发请求之前本地估算 token：超预算就压缩/裁剪历史，实在放不下直接拒绝
+        # 不再等 API 返回 BadRequestError 才发现上下文过大
+        stats = self.token_counter.preflight(self.system_prompt, tools, messages, max_tokens)
+        self.renderer.log(
+            f"  [token 预估] 共 {stats['total']}（system {stats['system']} / "
+            f"tools {stats['tools']} / messages {stats['messages']}）",
+            kind="tokens", **stats
+        )
+        if stats["compacted"] or stats["dropped"]:
+            self.renderer.log(
+                f"  [上下文裁剪] 压缩 {stats['compacted']} 条早期工具结果，丢弃 {stats['dropped']} 条早期消息",
+                kind="warning"
+            )
 
         for attempt in range(max_retries):
             try:
                 with self.client.messages.stream(
                     model=self.model,
-                    max_tokens=4096,
+                    max_tokens=max_tokens,
                     system=self.system_prompt,
-                    tools=get_all_tools(),
+                    tools=tools,
                     messages=messages
                 ) as stream:
-                    # 边生成边打印文字（打字机效果）
+                    # 边生成边打印文字（打字机效果），token 由渲染器按帧合并输出
                     for text in stream.text_stream:
-                        print(text, end="", flush=True)
+                        self.renderer.stream(text)
+                    self.renderer.end_stream()
 
                     # 返回完整 response，和 create() 的返回值接口一致
                     return stream.get_final_message()
@@ -198,27 +324,27 @@ class Agent:
             except anthropic_lib.RateLimitError as e:
                 if attempt < max_retries - 1:
                     wait_time = 2 ** attempt
-                    print(f"\n  [重试] 触发限流 (429)，{wait_time}s 后重试 ({attempt + 1}/{max_retries})...")
+                    self.renderer.log(f"\n  [重试] 触发限流 (429)，{wait_time}s 后重试 ({attempt + 1}/{max_retries})...")
                     time.sleep(wait_time)
                 else:
-                    print(f"\n  [放弃] 已重试 {max_retries} 次，限流未解除")
+                    self.renderer.log(f"\n  [放弃] 已重试 {max_retries} 次，限流未解除")
                     raise
 
             except anthropic_lib.APIConnectionError as e:
                 if attempt < max_retries - 1:
                     wait_time = 2 ** attempt
-                    print(f"\n  [重试] 网络连接失败，{wait_time}s 后重试 ({attempt + 1}/{max_retries})...")
+                    self.renderer.log(f"\n  [重试] 网络连接失败，{wait_time}s 后重试 ({attempt + 1}/{max_retries})...")
                     time.sleep(wait_time)
                 else:
-                    print(f"\n  [放弃] 已重试 {max_retries} 次，网络仍不通")
+                    self.renderer.log(f"\n  [放弃] 已重试 {max_retries} 次，网络仍不通")
                     raise
 
             except anthropic_lib.AuthenticationError:
-                print(f"\n  [鉴权失败] API Key 无效，不再重试")
+                self.renderer.log("\n  [鉴权失败] API Key 无效，不再重试", kind="error")
                 raise
 
             except anthropic_lib.BadRequestError as e:
-                print(f"\n  [请求错误] 参数有问题，不再重试: {e}")
+                self.renderer.log(f"\n  [请求错误] 参数有问题，不再重试: {e}", kind="error")
                 raise
 
     def _process_tool_calls(self, messages: list, response) -> None:
@@ -229,6 +355,9 @@ class Agent:
            - 信任 LLM 策略：假设 LLM 把独立操作放在同一轮，有依赖的分开轮次
            - tool_results 必须按原始顺序返回（用 tool_use_id 对齐，不能按完成顺序）
         """
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+        from tools import execute_tool
+
         messages.append({
             "role": "assistant",
             "content": response.content
@@ -237,34 +366,42 @@ class Agent:
         tool_blocks = [b for b in response.content if b.type == "tool_use"]
         tool_count = len(tool_blocks)
 
-        print(f"\n  并行执行 {tool_count} 个工具:")
+        self.renderer.log(f"\n  并行执行 {tool_count} 个工具:")
         for block in tool_blocks:
-            print(f"    - {block.name}({block.input})")
+            self.renderer.log(f"    - {block.name}({block.input})")
+
+        # ⭐ 核心竞争力 ⑨ Safety & Guardrails
+        # 并行执行之前，在主线程里统一审批：策略自动放行/拒绝，剩下的合并成一次确认
+        denied = self.approval_policy.review(tool_blocks)
 
         # 并行执行所有工具，结果存入 tool_use_id → result 的字典
         results = {}
 
         def run_tool(block):
-            return block.id, execute_tool(block.name, block.input)
+            """返回 (tool_use_id, 放进历史的结果, 控制台预览)"""
+            if block.id in denied:
+                return block.id, denied[block.id], denied[block.id]
+            result = execute_tool(block.name, block.input)
+            # 预览基于原始结果（行数等信息才准确），再做存储
+            display = preview(result)
+            # ⭐ 核心竞争力 ① Context Management
+            # 大结果存到旁路存储，历史里只放摘要 + handle
+            # fetch_result 自身的分页结果不再存储（单页已限制大小）
+            if block.name != "fetch_result":
+                result = default_store.spill(result)
+            return block.id, result, display
 
         with ThreadPoolExecutor(max_workers=tool_count) as executor:
             futures = {executor.submit(run_tool, block): block for block in tool_blocks}
             for future in as_completed(futures):
-                tool_use_id, result = future.result()
+                tool_use_id, result, display = future.result()
                 block = futures[future]
                 results[tool_use_id] = result
 
-                result_lines = result.split('\n')
-                if len(result_lines) > 5:
-                    display_result = '\n'.join(result_lines[:5]) + f"\n      ... (共 {len(result_lines)} 行)"
-                elif len(result) > 200:
-                    display_result = result[:200] + "..."
-                else:
-                    display_result = result
-
-                indented_result = display_result.replace('\n', '\n      ')
-                print(f"\n  [完成] {block.name}")
-                print(f"      结果: {indented_result}")
+                # 只截取前几行做预览，不 split 整个结果
+                indented_result = display.replace('\n', '\n      ')
+                self.renderer.log(f"\n  [完成] {block.name}")
+                self.renderer.log(f"      结果: {indented_result}")
 
         # 按原始顺序构建 tool_results（顺序必须和 tool_use 一致）
         tool_results = [
@@ -277,67 +414,80 @@ class Agent:
             "content": tool_results
         })
 
-    def _print_header(self, title: str) -> None:
-        print(f"\n{'='*60}")
-        print(f"  {title}")
-        print('='*60)
-
-    def _print_messages_summary(self, messages: list) -> None:
-        print(f"\n  messages 队列 ({len(messages)} 条):")
-        for i, msg in enumerate(messages):
-            role = msg["role"][:4]
-            content = msg["content"]
-
-            if isinstance(content, str):
-                preview = content[:40] + "..." if len(content) > 40 else content
-                print(f"  [{i}] {role}: \"{preview}\"")
-            elif isinstance(content, list):
-                block_types = []
-                for block in content:
-                    if isinstance(block, dict):
-                        block_types.append(block.get("type", "?"))
-                    else:
-                        btype = getattr(block, "type", "?")
-                        if btype == "tool_use":
-                            btype = f"tool:{block.name}"
-                        block_types.append(btype)
-                print(f"  [{i}] {role}: [{', '.join(block_types)}]")
-
     def _print_response_content(self, response) -> None:
         # ⭐ streaming 模式下，文字已经实时打印过了，这里只显示工具调用
         tool_blocks = [b for b in response.content if b.type == "tool_use"]
         if tool_blocks:
-            print(f"\n  工具调用:")
+            self.renderer.log(f"\n  工具调用:")
             for block in tool_blocks:
-                print(f"    tool_use: {block.name}({block.input})")
+                self.renderer.log(f"    tool_use: {block.name}({block.input})")
 
 
 # ============================================================
 # 主程序：交互式对话循环（REPL）
 # ============================================================
 
+def _parse_args():
+    parser = argparse.ArgumentParser(description="编程助手 Agent")
+    parser.add_argument("task", nargs="?", help="直接执行的任务（执行完即退出）；不传则进入交互模式")
+    parser.add_argument("--non-interactive", action="store_true",
+                        help="非交互模式：策略未允许的写入/执行一律拒绝，不弹确认")
+    parser.add_argument("--workspace", action="append", default=[], metavar="DIR",
+                        help="工作区根目录（可多次指定），默认当前目录")
+    parser.add_argument("--allow-write", action="append", default=[], metavar="GLOB",
+                        help="自动允许写入的路径 glob，相对工作区（可多次指定），如 'src/*.py'、'src/**/*.py'")
+    parser.add_argument("--allow-command", action="append", default=[], metavar="PATTERN",
+                        help="自动允许执行的命令模式（可多次指定），如 'python *'")
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument("--quiet", action="store_true",
+                        help="安静模式：只输出最终回答、错误和确认提示")
+    output.add_argument("--json", action="store_true",
+                        help="JSON 事件模式：每行输出一个 JSON 事件，适合批处理")
+    return parser.parse_args()
+
+
 def main():
+    args = _parse_args()
+
+    if args.quiet:
+        set_renderer(Renderer(mode="quiet"))
+    elif args.json:
+        set_renderer(Renderer(mode="json"))
+    renderer = get_renderer()
+
     if not ANTHROPIC_API_KEY or ANTHROPIC_API_KEY == "在这里填入你的API Key":
-        print("错误：请在 config.py 中设置你的 ANTHROPIC_API_KEY")
+        renderer.log("错误：请在 config.py 中设置你的 ANTHROPIC_API_KEY", kind="error")
         return
 
-    agent = Agent(max_turns=10)
+    policy = ApprovalPolicy(
+        workspace_roots=args.workspace or None,
+        allow_write_globs=args.allow_write,
+        allow_commands=args.allow_command,
+        interactive=not args.non_interactive,
+    )
+    agent = Agent(max_turns=10, approval_policy=policy)
+
+    # 单次任务模式：适合脚本和无人值守运行
+    if args.task:
+        agent.run(args.task)
+        return
 
-    print("=" * 60)
-    print("  编程助手 Agent (输入 quit 退出, reset 清空对话)")
-    print("=" * 60)
+    # 所有输出都经过渲染器：JSON 模式下 stdout 只有 JSON 事件
+    renderer.log("=" * 60)
+    renderer.log("  编程助手 Agent (输入 quit 退出, reset 清空对话)")
+    renderer.log("=" * 60)
 
     while True:
         try:
-            user_input = input("\n你: ").strip()
+            user_input = renderer.input("\n你: ").strip()
         except (EOFError, KeyboardInterrupt):
-            print("\n再见！")
+            renderer.log("\n再见！")
             break
 
         if not user_input:
             continue
         if user_input.lower() == "quit":
-            print("再见！")
+            renderer.log("再见！")
             break
         if user_input.lower() == "reset":
             agent.reset()
@@ -0,0 +1,217 @@
+"""
+审批引擎：基于策略的自动审批 + 每轮一次的批量确认
+
+⭐ 核心竞争力 ⑨ Safety & Guardrails
+
+问题：write_file / execute_code 在 _process_tool_calls 的工作线程里调用 input()，
+  - 并行的工具调用互相阻塞在各自的确认提示上
+  - 多个提示在终端上交错输出
+  - 无人值守运行根本不可能
+
+做法：
+  - 声明式规则：写入用路径 glob（按路径段匹配，跨目录用 **），执行用命令模式，外加工作区根目录
+  - 执行工具之前（还在主线程里）统一判定：allow / deny / ask
+  - 剩下需要确认的，合并成每轮一次的批量确认提示
+  - 非交互模式下 ask 一律拒绝，工具线程不再碰 input()
+"""
+
+import os
+import re
+from fnmatch import fnmatch
+
+from renderer import get_renderer
+
+
+ALLOW = "allow"
+DENY = "deny"
+ASK = "ask"
+
+# 需要审批的工具（其余都是只读工具，直接放行）
+GUARDED_TOOLS = ("write_file", "execute_code")
+
+# 默认禁止的写入路径：敏感配置和密钥文件
+DEFAULT_DENY_WRITE_GLOBS = (
+    "config.py",
+    "*.env",
+    ".env*",
+    "*secret*",
+    "*.pem",
+    "*.key",
+    "**/.git/**",
+)
+
+# 默认禁止的命令模式
+DEFAULT_DENY_COMMANDS = (
+    "sudo *",
+    "rm -rf /",
+    "rm -rf ~*",
+    "*mkfs*",
+    "*shutdown*",
+    "*reboot*",
+)
+
+# 含 shell 元字符的命令可能拼接/后台运行/重定向/替换出别的命令，不自动放行（仍可人工确认）
+# 例如 "python a.py & rm -rf ~" 能匹配 "python *"，但实际会执行两条命令
+SHELL_METACHARS = re.compile(r"[;&|`$<>\n\r]")
+
+
+def match_path(path: str, pattern: str) -> bool:
+    """
+    按路径段匹配 glob（"/" 分隔）
+
+    fnmatch 的 * 会跨过 "/"，"src/*.py" 会匹配到 "src/x/y.py"；
+    这里每一段单独 fnmatch，* 只匹配一段内的字符，
+    需要跨目录时显式写 **（匹配零个或多个路径段），如 "src/**/*.py"
+    """
+    return _match_segments(path.split("/"), pattern.split("/"))
+
+
+def _match_segments(parts: list, pats: list) -> bool:
+    if not pats:
+        return not parts
+    if pats[0] == "**":
+        # ** 吞掉 0..len(parts) 个路径段
+        return any(_match_segments(parts[i:], pats[1:]) for i in range(len(parts) + 1))
+    return bool(parts) and fnmatch(parts[0], pats[0]) and _match_segments(parts[1:], pats[1:])
+
+
+class ApprovalPolicy:
+    """
+    声明式审批策略
+
+    判定顺序：deny 规则 → allow 规则 → 交互模式下 ask，非交互模式下 deny
+    """
+
+    def __init__(self,
+                 workspace_roots: list = None,
+                 allow_write_globs: list = (),
+                 deny_write_globs: list = DEFAULT_DENY_WRITE_GLOBS,
+                 allow_commands: list = (),
+                 deny_commands: list = DEFAULT_DENY_COMMANDS,
+                 interactive: bool = True):
+        self.workspace_roots = [os.path.realpath(r) for r in (workspace_roots or [os.getcwd()])]
+        self.allow_write_globs = tuple(allow_write_globs)
+        self.deny_write_globs = tuple(deny_write_globs)
+        self.allow_commands = tuple(allow_commands)
+        self.deny_commands = tuple(deny_commands)
+        self.interactive = interactive
+
+    def decide(self, tool_name: str, tool_input: dict) -> tuple:
+        """返回 (ALLOW / DENY / ASK, 原因)"""
+        if tool_name == "write_file":
+            return self._decide_write(tool_input.get("path", ""))
+        if tool_name == "execute_code":
+            return self._decide_command(tool_input.get("command", ""))
+        return ALLOW, ""
+
+    def _relative_to_workspace(self, path: str):
+        """路径在某个工作区根目录内时，返回相对路径；否则返回 None"""
+        real = os.path.realpath(path)
+        for root in self.workspace_roots:
+            if real == root or real.startswith(root + os.sep):
+                return os.path.relpath(real, root).replace(os.sep, "/")
+        return None
+
+    def _decide_write(self, path: str) -> tuple:
+        rel = self._relative_to_workspace(path)
+        name = os.path.basename(path)
+        candidates = [c for c in (rel, name) if c]
+
+        for pattern in self.deny_write_globs:
+            if any(match_path(c, pattern) for c in candidates):
+                return DENY, f"策略禁止写入该路径（匹配 {pattern}）"
+
+        if rel is not None:
+            for pattern in self.allow_write_globs:
+                if match_path(rel, pattern):
+                    return ALLOW, f"策略允许写入（匹配 {pattern}）"
+
+        return self._fallback("写入文件")
+
+    def _decide_command(self, command: str) -> tuple:
+        command = command.strip()
+
+        for pattern in self.deny_commands:
+            if fnmatch(command, pattern):
+                return DENY, f"策略禁止执行该命令（匹配 {pattern}）"
+
+        if not SHELL_METACHARS.search(command):
+            for pattern in self.allow_commands:
+                if fnmatch(command, pattern):
+                    return ALLOW, f"策略允许执行（匹配 {pattern}）"
+
+        return self._fallback("执行命令")
+
+    def _fallback(self, action: str) -> tuple:
+        if self.interactive:
+            return ASK, ""
+        return DENY, f"非交互模式，策略未允许{action}"
+
+    # ============================================================
+    # 批量审批：每轮只问一次
+    # ============================================================
+
+    def review(self, tool_blocks: list) -> dict:
+        """
+        审批一轮中的所有工具调用（在主线程中调用，工具执行之前）
+
+        返回 tool_use_id → 拒绝原因 的字典；不在字典里的表示允许执行
+        """
+        denied = {}
+        pending = []
+        renderer = get_renderer()
+
+        for block in tool_blocks:
+            decision, reason = self.decide(block.name, block.input)
+            if decision == DENY:
+                denied[block.id] = reason
+                renderer.log(f"  [策略拒绝] {block.name}: {reason}", kind="policy", tool=block.name)
+            elif decision == ASK:
+                pending.append(block)
+            elif block.name in GUARDED_TOOLS:
+                renderer.log(f"  [策略放行] {block.name}: {reason}", kind="policy", tool=block.name)
+
+        if pending:
+            approved = self._prompt_batch(pending)
+            for block in pending:
+                if block.id not in approved:
+                    denied[block.id] = _REJECT_MESSAGES.get(block.name, "用户拒绝执行该操作")
+
+        return denied
+
+    def _prompt_batch(self, blocks: list) -> set:
+        """合并的确认提示：y 全部允许，n 全部拒绝，或输入编号（如 1,3）只允许部分"""
+        lines = [f"\n  [安全确认] 以下 {len(blocks)} 个操作需要确认:"]
+        for i, block in enumerate(blocks, 1):
+            if block.name == "write_file":
+                content = block.input.get("content", "")
+                lines.append(f"    {i}. 写入文件: {block.input.get('path')}")
+                lines.append(f"       内容预览: {content[:100]}{'...' if len(content) > 100 else ''}")
+            elif block.name == "execute_code":
+                lines.append(f"    {i}. 执行命令: {block.input.get('command')}")
+            else:
+                lines.append(f"    {i}. {block.name}({block.input})")
+        # prompt 类消息在 quiet 模式下也会输出，并立即 flush
+        renderer = get_renderer()
+        renderer.log("\n".join(lines), kind="prompt")
+
+        try:
+            answer = renderer.input("  确认? (y 全部允许 / n 全部拒绝 / 编号如 1,3 只允许部分): ").strip().lower()
+        except EOFError:
+            answer = "n"
+
+        if answer == "y":
+            return {block.id for block in blocks}
+
+        approved = set()
+        for part in answer.replace("，", ",").split(","):
+            part = part.strip()
+            if part.isdigit() and 1 <= int(part) <= len(blocks):
+                approved.add(blocks[int(part) - 1].id)
+        return approved
+
+
+_REJECT_MESSAGES = {
+    "write_file": "用户拒绝写入该文件",
+    "execute_code": "用户拒绝执行该命令",
+}
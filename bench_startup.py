@@ -0,0 +1,93 @@
+"""
+启动耗时基准：基于 python -X importtime
+
+⭐ 核心竞争力 ⑧ Cost & Latency（启动速度）
+
+用法：
+    python bench_startup.py                # 默认测 import agent，跑 5 次取中位数
+    python bench_startup.py --runs 10 --max-ms 150
+    python bench_startup.py --module tools
+
+检查两件事，任一不满足时返回码为 1（可以放进 CI）：
+  1. 模块的累计 import 耗时（中位数）不超过 --max-ms
+  2. 启动时没有导入应该延迟加载的重型模块（anthropic、subprocess 等）
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+
+
+# 启动路径上不应该出现的模块（都应该在第一次使用时才导入）
+DEFERRED_MODULES = ("anthropic", "httpx", "pydantic", "subprocess", "concurrent.futures", "tools")
+
+
+def measure(module: str) -> dict:
+    """
+    在新的解释器里 import 一次模块，解析 -X importtime 的输出
+
+    每行格式：import time: self [us] | cumulative | imported package
+    返回 模块名 → (self_us, cumulative_us)
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        last_line = proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else ""
+        raise RuntimeError(f"import {module} 失败：{last_line}")
+
+    timings = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        timings[name.strip()] = (int(self_us), int(cumulative_us))
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="启动耗时基准（python -X importtime）")
+    parser.add_argument("--module", default="agent", help="要测量的模块，默认 agent")
+    parser.add_argument("--runs", type=int, default=5, help="测量次数，取中位数")
+    parser.add_argument("--max-ms", type=float, default=100.0, help="累计 import 耗时上限（毫秒）")
+    parser.add_argument("--top", type=int, default=10, help="显示最慢的前 N 个模块")
+    args = parser.parse_args()
+
+    try:
+        runs = [measure(args.module) for _ in range(args.runs)]
+    except RuntimeError as e:
+        print(f"错误：{e}")
+        sys.exit(1)
+
+    totals_ms = [run[args.module][1] / 1000 for run in runs]
+    median_ms = statistics.median(totals_ms)
+
+    print(f"import {args.module}: 中位数 {median_ms:.1f} ms"
+          f"（{args.runs} 次，最快 {min(totals_ms):.1f} ms，最慢 {max(totals_ms):.1f} ms）")
+
+    print(f"\n最慢的 {args.top} 个模块（self 耗时，最后一次测量）:")
+    last = runs[-1]
+    for name, (self_us, cumulative_us) in sorted(last.items(), key=lambda kv: -kv[1][0])[:args.top]:
+        print(f"  {self_us / 1000:8.2f} ms  (累计 {cumulative_us / 1000:8.2f} ms)  {name}")
+
+    failed = False
+
+    eager = [m for m in DEFERRED_MODULES if m in last and m != args.module]
+    if eager:
+        print(f"\n[回归] 启动时导入了应该延迟加载的模块: {', '.join(eager)}")
+        failed = True
+
+    if median_ms > args.max_ms:
+        print(f"\n[回归] 启动耗时 {median_ms:.1f} ms 超过上限 {args.max_ms:.1f} ms")
+        failed = True
+
+    if not failed:
+        print("\n[通过] 启动耗时和延迟加载检查均通过")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
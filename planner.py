@@ -0,0 +1,230 @@
+"""
+结构化计划（DAG）+ 并行步骤执行
+
+⭐ 核心竞争力 ⑤ Planning & Reasoning / ⑧ Cost & Latency
+
+问题：_create_plan() 只返回一段编号列表文字，注入历史后一轮一轮地执行。
+即使步骤之间互不依赖（比如"审查模块 A"和"审查模块 B"），也只能串行。
+
+做法：
+  - 规划阶段让 LLM 输出 JSON：每个步骤有 id、task、depends_on
+  - parse_plan() 解析并校验（id 唯一、依赖存在、无环）
+  - PlanExecutor 按依赖调度：依赖都完成的步骤立即提交到线程池，
+    每个步骤由独立的 StepWorker 执行（独立上下文，只看到原始任务 + 依赖步骤的结果）
+  - 所有结果汇总回 Orchestrator 的对话历史
+  - 总耗时取决于关键路径长度，而不是步骤数
+
+计划没有可并行的步骤（或解析失败）时，退回原来的单线程执行方式。
+"""
+
+import json
+import re
+
+from subagent import SubAgent, SubAgentIncompleteError
+
+
+# ============================================================
+# 计划数据结构
+# ============================================================
+
+class PlanStep:
+    def __init__(self, step_id: str, task: str, depends_on: list):
+        self.id = step_id
+        self.task = task
+        self.depends_on = depends_on
+
+
+class Plan:
+    def __init__(self, steps: list):
+        self.steps = steps
+        self.by_id = {step.id: step for step in steps}
+
+    def depth(self) -> int:
+        """关键路径长度（最长依赖链上的步骤数）"""
+        levels = {}
+        for step in self.topological_order():
+            levels[step.id] = 1 + max((levels[d] for d in step.depends_on), default=0)
+        return max(levels.values(), default=0)
+
+    def is_parallel(self) -> bool:
+        """是否存在可以并行的步骤（关键路径比步骤数短）"""
+        return self.depth() < len(self.steps)
+
+    def topological_order(self) -> list:
+        """Kahn 算法；有环时抛出 ValueError"""
+        remaining = {step.id: set(step.depends_on) for step in self.steps}
+        order = []
+        while remaining:
+            ready = [sid for sid, deps in remaining.items() if not deps]
+            if not ready:
+                raise ValueError(f"计划中存在循环依赖: {', '.join(remaining)}")
+            for sid in ready:
+                order.append(self.by_id[sid])
+                del remaining[sid]
+            for deps in remaining.values():
+                deps.difference_update(ready)
+        return order
+
+    def to_text(self) -> str:
+        """转成编号列表文字（注入对话历史用）"""
+        lines = []
+        for i, step in enumerate(self.steps, 1):
+            deps = f"（依赖 {', '.join(step.depends_on)}）" if step.depends_on else ""
+            lines.append(f"{i}. [{step.id}] {step.task}{deps}")
+        return "\n".join(lines)
+
+
+def parse_plan(text: str):
+    """
+    从规划阶段的输出中解析计划
+
+    容忍 ```json 代码块和前后多余文字；格式不对、依赖不存在或有环时返回 None
+    """
+    match = re.search(r"\{.*\}", text, re.DOTALL)
+    if not match:
+        return None
+    try:
+        data = json.loads(match.group(0))
+        steps = [
+            PlanStep(str(s["id"]), str(s["task"]), [str(d) for d in s.get("depends_on", [])])
+            for s in data["steps"]
+        ]
+    except (ValueError, KeyError, TypeError):
+        return None
+
+    if not steps:
+        return None
+    plan = Plan(steps)
+    if len(plan.by_id) != len(steps):
+        return None
+    if any(d not in plan.by_id for step in steps for d in step.depends_on):
+        return None
+    try:
+        plan.topological_order()
+    except ValueError:
+        return None
+    return plan
+
+
+# ============================================================
+# 步骤 Worker：独立上下文的有界 Agent
+# ============================================================
+
+class StepWorker(SubAgent):
+    """
+    执行单个计划步骤的 Worker
+
+    和 SubAgent 的区别：
+      - 使用主 Agent 的工具集（不含 delegate_to_subagent，避免无限嵌套）
+      - 写入 / 执行由审批策略判定，但 Worker 不能弹确认提示：
+        策略未明确允许的操作一律拒绝，留给 Orchestrator 在主流程里处理
+      - 大结果同样存到结果存储，只把摘要放进上下文；预检压缩掉的结果也存进去
+    """
+
+    def __init__(self, step: PlanStep, approval_policy, max_turns: int = 5):
+        from result_store import default_store
+        from token_counter import TokenCounter
+        from tools import get_all_tools
+
+        super().__init__(max_turns=max_turns)
+        self.name = f"Worker {step.id}"
+        # Worker 有 fetch_result 工具，压缩掉的工具结果存进结果存储
+        self.token_counter = TokenCounter(store=default_store)
+        self.approval_policy = approval_policy
+        self.tools = tuple(t for t in get_all_tools() if t["name"] != "delegate_to_subagent")
+        self.system_prompt = """你是一个编程助手团队中的执行者，负责完成一个大任务中的一个步骤。
+- 只完成分配给你的步骤，不要做其他步骤的工作
+- 需要用户确认的写入/执行操作会被拒绝，遇到时在报告中说明需要主流程完成的操作
+- 完成后给出简洁的结果报告，其他步骤和最终汇总会用到它"""
+
+    def _execute_tool(self, tool_name: str, tool_input: dict) -> str:
+        from approval import ALLOW
+        from result_store import default_store
+        from tools import execute_tool
+
+        decision, reason = self.approval_policy.decide(tool_name, tool_input)
+        if decision != ALLOW:
+            return reason or "并行步骤中不能执行需要用户确认的操作，请在报告中说明，留给主流程完成"
+
+        result = execute_tool(tool_name, tool_input)
+        if tool_name != "fetch_result":
+            result = default_store.spill(result)
+        return result
+
+
+# ============================================================
+# 执行器：按依赖关系并行调度
+# ============================================================
+
+class PlanExecutor:
+    def __init__(self, plan: Plan, user_task: str, approval_policy, max_workers: int = 4):
+        self.plan = plan
+        self.user_task = user_task
+        self.approval_policy = approval_policy
+        self.max_workers = max_workers
+        self.failed = set()
+
+    def run(self) -> dict:
+        """
+        执行整个计划，返回 step_id → 结果 的字典；失败的步骤记录在 self.failed
+
+        不按层级一批一批执行：任何一个步骤完成后，立即检查并提交新就绪的步骤，
+        这样总耗时只取决于关键路径。
+        依赖步骤失败时，后续步骤不再执行，直接标记为失败（不会把错误信息当作"结果"传下去）
+        """
+        from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+        results = {}
+        self.failed = set()
+        pending = {step.id: set(step.depends_on) for step in self.plan.steps}
+
+        def complete(sid):
+            for deps in pending.values():
+                deps.discard(sid)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            running = {}
+            while pending or running:
+                # 提交就绪的步骤；依赖失败的步骤直接标记失败（可能连锁，所以循环到没有新变化）
+                progressed = True
+                while progressed:
+                    progressed = False
+                    for sid in [sid for sid, deps in pending.items() if not deps]:
+                        del pending[sid]
+                        step = self.plan.by_id[sid]
+                        failed_deps = [d for d in step.depends_on if d in self.failed]
+                        if failed_deps:
+                            results[sid] = f"步骤未执行：依赖的步骤 {', '.join(failed_deps)} 失败"
+                            self.failed.add(sid)
+                            complete(sid)
+                            progressed = True
+                        else:
+                            running[executor.submit(self._run_step, step, results)] = sid
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    sid = running.pop(future)
+                    try:
+                        results[sid] = future.result()
+                    except SubAgentIncompleteError as e:
+                        # Worker 达到最大轮次 / 上下文过大：同样算失败
+                        results[sid] = f"步骤未完成：{str(e)}"
+                        self.failed.add(sid)
+                    except Exception as e:
+                        results[sid] = f"步骤执行失败：{str(e)}"
+                        self.failed.add(sid)
+                    complete(sid)
+
+        return results
+
+    def _run_step(self, step: PlanStep, results: dict) -> str:
+        """在 Worker 线程中执行一个步骤：只给原始任务、本步骤和依赖步骤的结果"""
+        parts = [f"整体任务：{self.user_task}", f"你负责的步骤 [{step.id}]：{step.task}"]
+        for dep in step.depends_on:
+            parts.append(f"依赖步骤 [{dep}] 的结果：\n{results[dep]}")
+
+        worker = StepWorker(step, self.approval_policy)
+        return worker.run("\n\n".join(parts))
@@ -0,0 +1,204 @@
+"""
+控制台渲染器：缓冲 + 限帧输出，支持 quiet / JSON 事件模式
+
+⭐ 核心竞争力 ⑩ User Experience / ⑧ Cost & Latency
+
+问题：
+  - 流式循环里每个 token 都 print(text, flush=True)，一个 token 一次系统调用
+  - _print_messages_summary 每轮重印整个历史，整个会话的输出量是 O(n²)
+  - 走 SSH 或写 CI 日志时，终端 I/O 直接出现在 profile 里
+
+做法：
+  - stream()：token 先进缓冲区，按固定帧率（默认 20 帧/秒）合并成一帧输出
+  - messages_summary()：只打印上次之后新增的消息
+  - 三种模式：
+      normal：和原来一样的可读输出
+      quiet ：只输出最终回答、错误和需要用户确认的提示（适合脚本/批处理）
+      json  ：每行一个 JSON 事件（适合被其他程序消费）
+"""
+
+import json
+import sys
+import threading
+import time
+
+
+NORMAL = "normal"
+QUIET = "quiet"
+JSON = "json"
+
+# quiet 模式下仍然输出的消息类型
+_ALWAYS_VISIBLE = ("error", "warning", "prompt", "final")
+
+
+class Renderer:
+    def __init__(self, mode: str = NORMAL, fps: int = 20, out=None):
+        if mode not in (NORMAL, QUIET, JSON):
+            raise ValueError(f"未知的输出模式: {mode}")
+        self.mode = mode
+        self.frame_interval = 1.0 / fps
+        self.out = out or sys.stdout
+
+        self._buffer = []
+        self._last_flush = 0.0
+        self._summary_count = 0
+        # 工具在线程池里并行执行，多个线程可能同时输出
+        self._lock = threading.RLock()
+
+    # ============================================================
+    # 流式文字：合并成帧
+    # ============================================================
+
+    def stream(self, text: str) -> None:
+        """缓冲一个 token，距离上一帧超过 frame_interval 时才真正输出"""
+        if self.mode == QUIET:
+            return
+        with self._lock:
+            self._buffer.append(text)
+            if time.monotonic() - self._last_flush >= self.frame_interval:
+                self._flush_stream()
+
+    def end_stream(self) -> None:
+        """流结束：输出剩余缓冲，normal 模式下补一个换行"""
+        with self._lock:
+            self._flush_stream()
+            if self.mode == NORMAL:
+                self._write("\n")
+            self.flush()
+
+    def _flush_stream(self) -> None:
+        if not self._buffer:
+            return
+        chunk = "".join(self._buffer)
+        self._buffer.clear()
+        if self.mode == JSON:
+            self._write_event({"type": "text", "text": chunk})
+        else:
+            self._write(chunk)
+        self.flush()
+
+    # ============================================================
+    # 普通输出
+    # ============================================================
+
+    def log(self, text: str = "", kind: str = "info", **data) -> None:
+        """
+        输出一条消息
+
+        kind 决定 quiet 模式下是否可见（见 _ALWAYS_VISIBLE），
+        data 是 JSON 模式下附加的结构化字段
+        """
+        with self._lock:
+            self._flush_stream()
+            if self.mode == JSON:
+                self._write_event({"type": kind, "text": text.strip(), **data})
+            elif self.mode == NORMAL or kind in _ALWAYS_VISIBLE:
+                self._write(text + "\n")
+            else:
+                return
+            # 需要用户看到的内容立即输出，其余按帧率合并
+            if kind in _ALWAYS_VISIBLE or time.monotonic() - self._last_flush >= self.frame_interval:
+                self.flush()
+
+    def header(self, title: str) -> None:
+        with self._lock:
+            if self.mode == JSON:
+                self.log(title, kind="phase")
+            elif self.mode == NORMAL:
+                self.log(f"\n{'='*60}\n  {title}\n{'='*60}")
+
+    def final(self, text: str) -> None:
+        """最终回答：normal 模式已经流式输出过，quiet / json 模式在这里输出"""
+        if self.mode != NORMAL and text:
+            self.log(text, kind="final")
+
+    def input(self, prompt: str) -> str:
+        """
+        读取用户输入
+
+        JSON 模式下提示文字只作为 prompt 事件输出，input() 本身不往 stdout 写任何东西，
+        保证 stdout 始终是合法的 JSON lines
+        """
+        with self._lock:
+            self._flush_stream()
+            if self.mode == JSON:
+                self._write_event({"type": "prompt", "text": prompt.strip()})
+            self.flush()
+        return input("" if self.mode == JSON else prompt)
+
+    def reset_summary(self) -> None:
+        """对话历史被清空时调用，下一次 messages_summary 从第 0 条开始打印"""
+        with self._lock:
+            self._summary_count = 0
+
+    def messages_summary(self, messages: list) -> None:
+        """增量打印 messages 队列：只打印上次之后新增的消息"""
+        with self._lock:
+            if len(messages) < self._summary_count:
+                # 历史被预检裁剪过，从头开始
+                self._summary_count = 0
+            start = self._summary_count
+            self._summary_count = len(messages)
+
+            if self.mode == QUIET:
+                return
+
+            entries = [(i, messages[i]["role"][:4], _describe(messages[i]["content"]))
+                       for i in range(start, len(messages))]
+
+            if self.mode == JSON:
+                self._write_event({
+                    "type": "messages",
+                    "count": len(messages),
+                    "new": [{"index": i, "role": role, "content": desc} for i, role, desc in entries],
+                })
+                return
+
+            self.log(f"\n  messages 队列 ({len(messages)} 条，新增 {len(entries)} 条):")
+            for i, role, desc in entries:
+                self.log(f"  [{i}] {role}: {desc}")
+
+    def flush(self) -> None:
+        with self._lock:
+            self.out.flush()
+            self._last_flush = time.monotonic()
+
+    def _write(self, text: str) -> None:
+        self.out.write(text)
+
+    def _write_event(self, event: dict) -> None:
+        self.out.write(json.dumps(event, ensure_ascii=False, default=str) + "\n")
+
+
+def _describe(content) -> str:
+    """消息内容的单行描述：文字取前 40 字符，block 列表显示类型"""
+    if isinstance(content, str):
+        preview = content[:40] + "..." if len(content) > 40 else content
+        return f"\"{preview}\""
+
+    block_types = []
+    for block in content:
+        if isinstance(block, dict):
+            block_types.append(block.get("type", "?"))
+        else:
+            btype = getattr(block, "type", "?")
+            if btype == "tool_use":
+                btype = f"tool:{block.name}"
+            block_types.append(btype)
+    return f"[{', '.join(block_types)}]"
+
+
+# ============================================================
+# 全局渲染器：main() 根据命令行参数设置，Sub-agent 和审批引擎共用
+# ============================================================
+
+_current = Renderer()
+
+
+def get_renderer() -> Renderer:
+    return _current
+
+
+def set_renderer(renderer: Renderer) -> None:
+    global _current
+    _current = renderer
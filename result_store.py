@@ -0,0 +1,148 @@
+"""
+工具结果存储：大结果不进对话历史
+
+⭐ 核心竞争力 ① Context Management / ⑧ Cost & Latency
+
+问题：每个工具结果都原样进入 tool_results，并永远留在历史里。
+一次 execute_code 跑测试、一次大的 read_file，就能让之后的每次请求
+都多带几百 KB。
+
+做法：
+  - 超过阈值的结果存到旁路存储（内存字典），不进历史
+  - 历史里只放简短摘要（开头几行）+ 一个 handle
+  - LLM 需要更多内容时，调用 fetch_result(handle, start_line, end_line) 分页读取
+"""
+
+import threading
+
+
+# 超过这个字符数的结果会被存储，历史里只放摘要
+SPILL_THRESHOLD = 8000
+
+# 摘要里保留的开头行数
+SUMMARY_HEAD_LINES = 20
+
+# fetch_result 单次最多返回的行数 / 字符数（保证单页不会再被存储）
+FETCH_MAX_LINES = 200
+FETCH_MAX_CHARS = SPILL_THRESHOLD
+
+
+def _head(text: str, max_lines: int) -> tuple:
+    """
+    返回 (前 max_lines 行, 是否被截断)
+
+    用 str.find 找换行位置，只切出需要的前缀，不 split 整个字符串
+    """
+    pos = -1
+    for _ in range(max_lines):
+        pos = text.find("\n", pos + 1)
+        if pos == -1:
+            return text, False
+    return text[:pos], True
+
+
+def preview(result: str, max_lines: int = 5, max_chars: int = 200) -> str:
+    """
+    生成控制台预览（不复制整个结果）
+
+    - 超过 max_lines 行：显示前 max_lines 行 + 总行数
+    - 否则超过 max_chars：显示前 max_chars 个字符
+    """
+    head, truncated = _head(result, max_lines)
+    if truncated:
+        return head + f"\n... (共 {result.count(chr(10)) + 1} 行)"
+    if len(result) > max_chars:
+        return result[:max_chars] + "..."
+    return result
+
+
+class ResultStore:
+    """
+    线程安全的工具结果存储
+
+    _process_tool_calls 在线程池里并行执行工具，spill() 可能被多个线程同时调用
+    """
+
+    def __init__(self, threshold: int = SPILL_THRESHOLD):
+        self.threshold = threshold
+        self._results = {}
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def spill(self, result: str) -> str:
+        """
+        结果不超过阈值：原样返回
+        超过阈值：存储完整结果，返回 摘要 + handle（放进对话历史）
+        """
+        if len(result) <= self.threshold:
+            return result
+
+        handle = self.store(result)
+        head, _ = _head(result, SUMMARY_HEAD_LINES)
+        cut_mid_line = len(head) > self.threshold // 2
+        if cut_mid_line:
+            head = head[:self.threshold // 2]
+        total_lines = result.count("\n") + 1
+
+        # 如实报告摘要里实际包含了多少：行数可能不足 SUMMARY_HEAD_LINES，也可能被按字符截断
+        shown_lines = head.count("\n") + 1
+        shown = f"前 {shown_lines} 行 / {len(head)} 字符"
+        if cut_mid_line:
+            shown += f"（第 {shown_lines} 行不完整）"
+
+        return (
+            f"{head}{'...' if cut_mid_line else ''}\n"
+            f"... [结果过大已存储，handle={handle}，共 {total_lines} 行 / {len(result)} 字符。"
+            f"以上为{shown}，如需更多内容请调用 "
+            f"fetch_result(handle=\"{handle}\", start_line=..., end_line=...)]"
+        )
+
+    def store(self, result: str) -> str:
+        """不论大小都存储，返回 handle（上下文预检压缩早期工具结果时使用）"""
+        with self._lock:
+            self._counter += 1
+            handle = f"r{self._counter}"
+            self._results[handle] = result
+        return handle
+
+    def fetch(self, handle: str, start_line: int = 1, end_line: int = None) -> str:
+        """按行号范围（从 1 开始，闭区间）读取已存储的结果"""
+        with self._lock:
+            result = self._results.get(handle)
+        if result is None:
+            return f"错误：找不到结果 - {handle}"
+
+        lines = result.split("\n")
+        total = len(lines)
+
+        start_line = max(1, start_line)
+        if end_line is None:
+            end_line = start_line + FETCH_MAX_LINES - 1
+        if end_line < start_line:
+            return f"错误：结束行 {end_line} 小于起始行 {start_line}"
+        if start_line > total:
+            return f"错误：起始行 {start_line} 超出范围（共 {total} 行）"
+        end_line = min(end_line, total, start_line + FETCH_MAX_LINES - 1)
+
+        page = "\n".join(lines[start_line - 1:end_line])
+        if len(page) > FETCH_MAX_CHARS:
+            page = page[:FETCH_MAX_CHARS] + "...(本页过长已截断，请缩小行范围)"
+
+        footer = f"[{handle} 第 {start_line}-{end_line} 行，共 {total} 行]"
+        if end_line < total:
+            footer += f"，下一页从第 {end_line + 1} 行开始"
+        return f"{page}\n{footer}"
+
+    def discard(self, handles) -> None:
+        """删除指定的结果（预检失败时撤销压缩过程中存入的内容）"""
+        with self._lock:
+            for handle in handles:
+                self._results.pop(handle, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._results.clear()
+
+
+# 全局默认存储：agent.py / TokenCounter 写入，fetch_result 工具读取
+default_store = ResultStore()
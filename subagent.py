@@ -23,8 +23,10 @@ Sub-agent: 专职代码审查员
 """
 
 import os
-from anthropic import Anthropic
-from config import ANTHROPIC_API_KEY
+import random
+import time
+from renderer import get_renderer
+from token_counter import TokenCounter, ContextTooLargeError
 
 
 # ============================================================
@@ -97,18 +99,30 @@ SUBAGENT_TOOL_FUNCTIONS = {
 # Sub-agent 类
 # ============================================================
 
+class SubAgentIncompleteError(Exception):
+    """Sub-agent 没有完成任务（达到最大轮次 / 上下文过大）"""
+
+
 class SubAgent:
     """
     专职代码审查 Sub-agent
 
     被 Orchestrator 通过 delegate_to_subagent 工具调用。
     run() 返回字符串结果，供 Orchestrator 使用。
+
+    子类可以覆盖 name / tools / _execute_tool() 换成别的角色和工具集
+    （见 planner.py 的 StepWorker）
     """
 
+    name = "Sub-agent"
+    tools = SUBAGENT_TOOLS
+
     def __init__(self, max_turns: int = 5):
-        self.client = Anthropic(api_key=ANTHROPIC_API_KEY)
+        self._client = None
         self.model = "claude-sonnet-4-20250514"
         self.max_turns = max_turns
+        self.renderer = get_renderer()
+        self.token_counter = TokenCounter()
         self.system_prompt = """你是一个专职代码审查员。你的工作是：
 - 阅读和分析代码文件
 - 评估代码质量、可读性、潜在 bug
@@ -117,27 +131,41 @@ class SubAgent:
 你只能读取文件，不能修改任何内容。
 审查完成后，给出简洁的审查报告。"""
 
+    @property
+    def client(self):
+        """第一次调用 LLM 时才创建客户端；config 和 anthropic SDK 都延迟导入"""
+        if self._client is None:
+            from anthropic import Anthropic
+            from config import ANTHROPIC_API_KEY
+            self._client = Anthropic(api_key=ANTHROPIC_API_KEY)
+        return self._client
+
     def run(self, task: str) -> str:
-        """运行 Sub-agent，返回审查结果字符串"""
-        print(f"\n    [Sub-agent 启动] {task}")
+        """
+        运行 Sub-agent，返回审查结果字符串
+
+        没有完成任务时抛出 SubAgentIncompleteError，而不是把失败说明当作结果返回，
+        调用方（delegate_to_subagent / PlanExecutor）据此区分成功和失败
+        """
+        self.renderer.log(f"\n    [{self.name} 启动] {task}")
 
         messages = [{"role": "user", "content": task}]
 
         turn = 0
         while turn < self.max_turns:
             turn += 1
-            print(f"    [Sub-agent 第 {turn} 轮]")
+            self.renderer.log(f"    [{self.name} 第 {turn} 轮]")
+
+            # 发请求前预检上下文大小，放不下就把原因作为结果返回给 Orchestrator
+            try:
+                self.token_counter.preflight(self.system_prompt, self.tools, messages, max_tokens=2048)
+            except ContextTooLargeError as e:
+                raise SubAgentIncompleteError(f"{self.name} 上下文过大，任务中止：{str(e)}")
 
-            response = self.client.messages.create(
-                model=self.model,
-                max_tokens=2048,
-                system=self.system_prompt,
-                tools=SUBAGENT_TOOLS,
-                messages=messages
-            )
+            response = self._create_with_retry(messages)
 
             if response.stop_reason == "end_turn":
-                print(f"    [Sub-agent 完成]")
+                self.renderer.log(f"    [{self.name} 完成]")
                 for block in response.content:
                     if hasattr(block, "text"):
                         return block.text
@@ -148,9 +176,8 @@ class SubAgent:
                 tool_results = []
                 for block in response.content:
                     if block.type == "tool_use":
-                        print(f"    [Sub-agent 工具] {block.name}({block.input})")
-                        func = SUBAGENT_TOOL_FUNCTIONS.get(block.name)
-                        result = func(**block.input) if func else f"未知工具: {block.name}"
+                        self.renderer.log(f"    [{self.name} 工具] {block.name}({block.input})")
+                        result = self._execute_tool(block.name, block.input)
                         tool_results.append({
                             "type": "tool_result",
                             "tool_use_id": block.id,
@@ -158,4 +185,41 @@ class SubAgent:
                         })
                 messages.append({"role": "user", "content": tool_results})
 
-        return "Sub-agent 达到最大轮次，任务未完成。"
+        raise SubAgentIncompleteError(f"{self.name} 达到最大轮次，任务未完成。")
+
+    def _create_with_retry(self, messages: list):
+        """
+        调用 LLM，遇到限流 / 网络错误时指数退避重试（和 Agent._call_llm_with_retry 一致）
+
+        并行执行计划步骤时，多个 Worker 同时请求，更容易触发 429；
+        等待时间加一点随机抖动，避免多个 Worker 同时醒来再次撞上限流
+        """
+        max_retries = 3
+        for attempt in range(max_retries):
+            try:
+                return self.client.messages.create(
+                    model=self.model,
+                    max_tokens=2048,
+                    system=self.system_prompt,
+                    tools=self.tools,
+                    messages=messages
+                )
+            except Exception as e:
+                # 出错时才导入 SDK 判断异常类型（client 已创建，SDK 此时必然已加载）
+                import anthropic as anthropic_lib
+                if not isinstance(e, (anthropic_lib.RateLimitError, anthropic_lib.APIConnectionError)):
+                    raise
+                if attempt < max_retries - 1:
+                    wait_time = 2 ** attempt + random.uniform(0, 1)
+                    reason = "触发限流 (429)" if isinstance(e, anthropic_lib.RateLimitError) else "网络连接失败"
+                    self.renderer.log(
+                        f"    [{self.name} 重试] {reason}，{wait_time:.1f}s 后重试 ({attempt + 1}/{max_retries})..."
+                    )
+                    time.sleep(wait_time)
+                else:
+                    self.renderer.log(f"    [{self.name} 放弃] 已重试 {max_retries} 次", kind="error")
+                    raise
+
+    def _execute_tool(self, tool_name: str, tool_input: dict) -> str:
+        func = SUBAGENT_TOOL_FUNCTIONS.get(tool_name)
+        return func(**tool_input) if func else f"未知工具: {tool_name}"
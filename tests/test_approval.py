@@ -0,0 +1,64 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import pytest
+
+from approval import ApprovalPolicy, ALLOW, DENY
+
+
+@pytest.fixture
+def policy():
+    return ApprovalPolicy(allow_commands=["python *"], interactive=False)
+
+
+def test_allow_command_matching_pattern(policy):
+    assert policy.decide("execute_code", {"command": "python a.py"})[0] == ALLOW
+
+
+@pytest.mark.parametrize("command", [
+    "python a.py & rm -rf ~",
+    "python a.py && rm -rf x",
+    "python a.py; rm x",
+    "python a.py | sh",
+    "python a.py > /etc/passwd",
+    "python $(rm x)",
+    "python `rm x`",
+    "python a.py\nrm x",
+    "python a.py\rrm x",
+])
+def test_shell_metacharacters_are_never_auto_allowed(policy, command):
+    assert policy.decide("execute_code", {"command": command})[0] == DENY
+
+
+@pytest.fixture
+def write_policy(tmp_path):
+    return ApprovalPolicy(workspace_roots=[str(tmp_path)], allow_write_globs=["src/*.py"],
+                          interactive=False)
+
+
+def test_allow_write_glob_matches_same_directory(write_policy, tmp_path):
+    path = tmp_path / "src" / "a.py"
+    assert write_policy.decide("write_file", {"path": str(path)})[0] == ALLOW
+
+
+def test_allow_write_star_does_not_cross_directories(write_policy, tmp_path):
+    path = tmp_path / "src" / "x" / "y.py"
+    assert write_policy.decide("write_file", {"path": str(path)})[0] == DENY
+
+
+def test_double_star_matches_nested_paths(tmp_path):
+    policy = ApprovalPolicy(workspace_roots=[str(tmp_path)], allow_write_globs=["src/**/*.py"],
+                            interactive=False)
+    for rel in ("src/a.py", "src/x/y.py", "src/x/y/z.py"):
+        assert policy.decide("write_file", {"path": str(tmp_path / rel)})[0] == ALLOW
+    assert policy.decide("write_file", {"path": str(tmp_path / "lib" / "a.py")})[0] == DENY
+
+
+def test_default_deny_covers_nested_git_paths(tmp_path):
+    policy = ApprovalPolicy(workspace_roots=[str(tmp_path)], allow_write_globs=["**"],
+                            interactive=False)
+    for rel in (".git/config", ".git/refs/heads/main", "vendor/lib/.git/HEAD"):
+        assert policy.decide("write_file", {"path": str(tmp_path / rel)})[0] == DENY
+    assert policy.decide("write_file", {"path": str(tmp_path / "src" / "a.py")})[0] == ALLOW
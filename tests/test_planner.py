@@ -0,0 +1,79 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from planner import PlanExecutor, StepWorker, parse_plan
+
+
+PLAN = """```json
+{"steps": [
+  {"id": "a", "task": "审查模块 A", "depends_on": []},
+  {"id": "b", "task": "审查模块 B", "depends_on": []},
+  {"id": "c", "task": "汇总", "depends_on": ["a", "b"]},
+  {"id": "d", "task": "写报告", "depends_on": ["c"]}
+]}
+```"""
+
+
+class FakeExecutor(PlanExecutor):
+    def __init__(self, plan, fail=()):
+        super().__init__(plan, "task", approval_policy=None)
+        self.fail = fail
+        self.ran = []
+
+    def _run_step(self, step, results):
+        self.ran.append(step.id)
+        if step.id in self.fail:
+            raise RuntimeError("429")
+        return f"{step.id} 完成"
+
+
+def test_parse_plan_rejects_cycles_and_free_text():
+    assert parse_plan('{"steps": [{"id": "a", "task": "x", "depends_on": ["b"]},'
+                      ' {"id": "b", "task": "y", "depends_on": ["a"]}]}') is None
+    assert parse_plan("1. 读文件\n2. 写文件") is None
+
+
+def test_parallel_plan_depth():
+    plan = parse_plan(PLAN)
+    assert plan.is_parallel()
+    assert plan.depth() == 3
+
+
+def test_failed_dependency_marks_dependents_failed_without_running():
+    executor = FakeExecutor(parse_plan(PLAN), fail=("a",))
+    results = executor.run()
+    assert executor.failed == {"a", "c", "d"}
+    assert "c" not in executor.ran and "d" not in executor.ran
+    assert results["b"] == "b 完成"
+    assert "a" in results["c"]
+
+
+class _Response:
+    stop_reason = "tool_use"
+    content = []
+
+
+class _LoopingClient:
+    """每轮都要求调用工具，Worker 永远到不了 end_turn"""
+
+    class messages:
+        @staticmethod
+        def create(**kwargs):
+            return _Response()
+
+
+class LoopingExecutor(PlanExecutor):
+    def _run_step(self, step, results):
+        worker = StepWorker(step, self.approval_policy, max_turns=2)
+        worker._client = _LoopingClient()
+        return worker.run(step.task)
+
+
+def test_worker_hitting_max_turns_is_marked_failed():
+    executor = LoopingExecutor(parse_plan(PLAN), "task", approval_policy=None)
+    results = executor.run()
+    assert executor.failed == {"a", "b", "c", "d"}
+    assert results["a"].startswith("步骤未完成")
+    assert "依赖的步骤" in results["c"]
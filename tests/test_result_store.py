@@ -0,0 +1,47 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from result_store import ResultStore
+
+
+def test_small_result_is_not_spilled():
+    assert ResultStore(threshold=100).spill("ok") == "ok"
+
+
+def test_summary_reports_lines_actually_shown():
+    result = "\n".join(str(i) for i in range(1000))
+    summary = ResultStore(threshold=100).spill(result)
+    assert "共 1000 行" in summary
+    assert "以上为前 20 行" in summary
+
+
+def test_summary_of_single_long_line_reports_characters():
+    summary = ResultStore(threshold=100).spill("x" * 100_000)
+    assert "以上为前 1 行 / 50 字符（第 1 行不完整）" in summary
+
+
+def test_fetch_pages_by_line_range():
+    store = ResultStore(threshold=10)
+    store.spill("\n".join(str(i) for i in range(1, 301)))
+    page = store.fetch("r1", 201)
+    assert page.startswith("201\n")
+    assert "[r1 第 201-300 行，共 300 行]" in page
+
+
+def test_fetch_rejects_end_before_start():
+    store = ResultStore(threshold=10)
+    store.spill("\n".join(str(i) for i in range(1, 301)))
+    assert store.fetch("r1", 10, 3).startswith("错误：结束行 3 小于起始行 10")
+    assert store.fetch("r1", 0, 0).startswith("错误：结束行 0 小于起始行 1")
+
+
+def test_fetch_result_tool_coerces_and_never_raises():
+    from result_store import default_store
+    from tools import fetch_result
+
+    handle = default_store.spill("\n".join(str(i) for i in range(1, 10001)))
+    handle = handle.split("handle=")[1].split("，")[0]
+    assert fetch_result(handle, start_line="5", end_line="6").startswith("5\n6\n")
+    assert fetch_result(handle, start_line="abc").startswith("读取结果失败")
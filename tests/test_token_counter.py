@@ -0,0 +1,84 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import pytest
+
+from result_store import ResultStore
+from token_counter import TokenCounter, ContextTooLargeError, COMPACTED_PLACEHOLDER
+
+
+def _run(task, result):
+    """一次 run() 产生的历史：任务 → 计划 → 请执行 → 工具调用 → 工具结果 → 最终回答"""
+    return [
+        {"role": "user", "content": task},
+        {"role": "assistant", "content": f"计划：{task}"},
+        {"role": "user", "content": "好，请严格按照计划执行，完成后汇报最终结果。"},
+        {"role": "assistant", "content": [{"type": "tool_use", "name": "read_file", "input": {}}]},
+        {"role": "user", "content": [{"type": "tool_result", "tool_use_id": "1", "content": result}]},
+        {"role": "assistant", "content": [{"type": "text", "text": "完成"}]},
+    ]
+
+
+def test_under_budget_is_untouched():
+    messages = _run("task", "x" * 100)
+    stats = TokenCounter().preflight("sys", (), messages, max_tokens=100)
+    assert stats["compacted"] == 0 and stats["dropped"] == 0
+    assert messages == _run("task", "x" * 100)
+
+
+def test_drops_middle_turns_but_keeps_first_task_and_plan():
+    # 中间一轮的大头是任务文字本身，压缩 tool_result 不够，只能整轮丢弃
+    messages = _run("first", "x" * 40) + _run("m" * 4000, "x" * 40) + _run("current", "y" * 40)[:3]
+    stats = TokenCounter().preflight("sys", (), messages, max_tokens=100, context_window=400)
+    assert stats["dropped"] == 6
+    assert messages[0]["content"] == "first"
+    assert messages[1]["content"] == "计划：first"
+    assert messages[6]["content"] == "current"
+
+
+def test_compacts_recent_oversized_result_before_giving_up():
+    messages = _run("task", "x" * 40000)[:5]
+    TokenCounter().preflight("sys", (), messages, max_tokens=100, context_window=400)
+    assert messages[0]["content"] == "task"
+    assert messages[4]["content"][0]["content"] == COMPACTED_PLACEHOLDER
+
+
+def test_compacted_result_is_recoverable_from_store():
+    store = ResultStore()
+    original = "\n".join(f"line {i}" for i in range(1, 5001))
+    messages = _run("task", original)[:5]
+    TokenCounter(store=store).preflight("sys", (), messages, max_tokens=100, context_window=400)
+    placeholder = messages[4]["content"][0]["content"]
+    assert "handle=r1" in placeholder and "fetch_result" in placeholder
+    assert store.fetch("r1", 4999, 5000).startswith("line 4999\nline 5000\n")
+
+
+def test_compaction_is_not_repeated_on_later_preflights():
+    store = ResultStore()
+    counter = TokenCounter(store=store)
+    messages = _run("task", "x" * 40000)[:5]
+    counter.preflight("sys", (), messages, max_tokens=100, context_window=400)
+    compacted = messages[4]
+    messages.append({"role": "assistant", "content": [{"type": "text", "text": "y" * 2000}]})
+    counter.preflight("sys", (), messages, max_tokens=100, context_window=800)
+    assert messages[4] is compacted
+    assert store.fetch("r2").startswith("错误")
+
+
+def test_history_unchanged_when_it_cannot_fit():
+    messages = _run("t" * 4000, "x" * 40000) + _run("middle", "m" * 4000)
+    original = list(messages)
+    with pytest.raises(ContextTooLargeError):
+        TokenCounter().preflight("sys", (), messages, max_tokens=100, context_window=400)
+    assert messages == original
+    assert all(a is b for a, b in zip(messages, original))
+
+
+def test_store_is_rolled_back_when_it_cannot_fit():
+    store = ResultStore()
+    messages = _run("t" * 4000, "x" * 40000) + _run("middle", "m" * 4000)
+    with pytest.raises(ContextTooLargeError):
+        TokenCounter(store=store).preflight("sys", (), messages, max_tokens=100, context_window=400)
+    assert store.fetch("r1").startswith("错误")
@@ -0,0 +1,260 @@
+"""
+本地 token 估算 + 请求预检（preflight）
+
+⭐ 核心竞争力 ① Context Management / ⑧ Cost & Latency
+
+问题：上下文超限时，只能等 API 返回 BadRequestError 才知道，
+白白浪费一次往返，run() 也只能报错退出。
+
+做法：
+  - 本地估算 token：中日韩字符按 1 字 1 token，其余按 4 字符 1 token（偏保守）
+  - 按消息缓存估算结果：历史只追加不修改，每轮只需估算新增的消息
+  - 每次调用 LLM 之前预检：
+      1. 没超预算：原样发送
+      2. 超了：先压缩较早的 tool_result（原文存进结果存储，历史里换成带 handle 的占位文字，
+         LLM 需要时仍可用 fetch_result 取回）
+      3. 还超：整轮丢弃中间的对话（第一轮的任务 + 计划、当前这一轮固定保留）
+      4. 还超：最近的 tool_result 也压缩
+      5. 还超：抛出 ContextTooLargeError，不发请求，历史保持原样
+  - 以上都在副本上进行，放得下才写回历史
+  - breakdown() 给出 system / tools / messages 各自的 token 数
+"""
+
+import json
+import threading
+
+
+# claude-sonnet-4 的上下文窗口
+CONTEXT_WINDOW = 200_000
+
+# 最近的几条消息不压缩（LLM 正在使用这些工具结果）
+KEEP_RECENT_MESSAGES = 4
+
+# 没有结果存储时的占位文字；有存储时占位文字里还带上 handle
+COMPACTED_PLACEHOLDER = "[早期工具结果已省略以节省上下文]"
+_COMPACTED_PREFIX = COMPACTED_PLACEHOLDER[:-1]
+
+# 有存储时，比带 handle 的占位文字还短的结果不压缩（替换了反而更长）
+MIN_COMPACT_CHARS = 200
+
+
+class ContextTooLargeError(Exception):
+    """压缩和裁剪之后仍然超出上下文预算"""
+
+
+def estimate_text(text: str) -> int:
+    """估算一段文字的 token 数"""
+    if not text:
+        return 0
+    cjk = sum(1 for ch in text if ord(ch) >= 0x2E80)
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _block_text(block) -> str:
+    """把一个 content block（dict 或 SDK 对象）转成用于估算的文字"""
+    if isinstance(block, dict):
+        content = block.get("content", block.get("text", ""))
+        if isinstance(content, list):
+            return "".join(_block_text(b) for b in content)
+        if block.get("type") == "tool_use":
+            return block.get("name", "") + json.dumps(block.get("input", {}), ensure_ascii=False)
+        return str(content)
+
+    btype = getattr(block, "type", "")
+    if btype == "tool_use":
+        return block.name + json.dumps(block.input, ensure_ascii=False)
+    return getattr(block, "text", "") or ""
+
+
+class TokenCounter:
+    """
+    带缓存的 token 估算器
+
+    缓存以消息对象的 id 为 key，同时保存消息引用：
+    引用保证对象不被回收（id 不会被复用），命中时用 is 再确认一次
+
+    传入 store（ResultStore）时，预检压缩掉的 tool_result 原文存进 store，
+    占位文字里带上 handle；不传时原文直接丢弃（Sub-agent 没有 fetch_result 工具）
+    """
+
+    # 每条消息的固定开销（role、分隔符等）
+    MESSAGE_OVERHEAD = 4
+
+    def __init__(self, store=None):
+        self.store = store
+        self._cache = {}
+        self._tools_cache = (None, 0)
+        self._lock = threading.Lock()
+
+    def count_message(self, message: dict) -> int:
+        key = id(message)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None and cached[0] is message:
+                return cached[1]
+
+        content = message["content"]
+        if isinstance(content, str):
+            tokens = estimate_text(content)
+        else:
+            tokens = sum(estimate_text(_block_text(b)) for b in content)
+        tokens += self.MESSAGE_OVERHEAD
+
+        with self._lock:
+            self._cache[key] = (message, tokens)
+        return tokens
+
+    def count_tools(self, tools) -> int:
+        # 工具列表在一次会话中基本不变，按对象缓存
+        cached_tools, tokens = self._tools_cache
+        if tools is cached_tools:
+            return tokens
+        tokens = estimate_text(json.dumps(list(tools), ensure_ascii=False)) if tools else 0
+        self._tools_cache = (tools, tokens)
+        return tokens
+
+    def breakdown(self, system: str, tools, messages: list) -> dict:
+        """各部分的 token 估算"""
+        system_tokens = estimate_text(system)
+        tools_tokens = self.count_tools(tools)
+        messages_tokens = sum(self.count_message(m) for m in messages)
+        return {
+            "system": system_tokens,
+            "tools": tools_tokens,
+            "messages": messages_tokens,
+            "total": system_tokens + tools_tokens + messages_tokens,
+        }
+
+    def forget(self, messages: list) -> None:
+        """清理已经不在历史中的消息缓存"""
+        live = {id(m) for m in messages}
+        with self._lock:
+            for key in [k for k in self._cache if k not in live]:
+                del self._cache[key]
+
+    # ============================================================
+    # 预检：在发请求之前把上下文控制在预算内
+    # ============================================================
+
+    def preflight(self, system: str, tools, messages: list, max_tokens: int,
+                  context_window: int = CONTEXT_WINDOW) -> dict:
+        """
+        检查 system + tools + messages + max_tokens 是否超出上下文窗口
+
+        超出时在副本上依次尝试：
+          1. 压缩较早的 tool_result
+          2. 丢弃中间的对话轮次（第一轮和当前轮固定保留）
+          3. 压缩最近的 tool_result
+        副本放得下才写回 messages（原地替换，之后每轮不用重复处理）；
+        放不下就抛出 ContextTooLargeError，messages 保持原样。
+        返回最终的 breakdown，其中 "compacted" / "dropped" 记录处理了多少条消息。
+        """
+        budget = context_window - max_tokens
+        stats = self.breakdown(system, tools, messages)
+        stats["compacted"] = 0
+        stats["dropped"] = 0
+        if stats["total"] <= budget:
+            return stats
+
+        candidate = list(messages)
+        stored = []  # 压缩时存入 store 的 handle，放不下时撤销
+
+        def compact(message):
+            return _compact_tool_results(message, self.store, stored)
+
+        def fits() -> bool:
+            stats.update(self.breakdown(system, tools, candidate))
+            return stats["total"] <= budget
+
+        # 第一步：压缩较早的 tool_result
+        for i in range(max(0, len(candidate) - KEEP_RECENT_MESSAGES)):
+            compacted = compact(candidate[i])
+            if compacted is not None:
+                candidate[i] = compacted
+                stats["compacted"] += 1
+
+        # 第二步：整轮丢弃中间的对话
+        # 第一轮（原始任务 + 计划）和当前这一轮固定保留，丢弃从第二轮开始
+        if not fits():
+            starts = _turn_starts(candidate)
+            while len(starts) >= 2:
+                del candidate[starts[0]:starts[1]]
+                stats["dropped"] += starts[1] - starts[0]
+                if fits():
+                    break
+                starts = _turn_starts(candidate)
+
+        # 第三步：最近的 tool_result 也压缩（从旧到新，放得下就停）
+        if stats["total"] > budget:
+            for i in range(len(candidate)):
+                compacted = compact(candidate[i])
+                if compacted is not None:
+                    candidate[i] = compacted
+                    stats["compacted"] += 1
+                    if fits():
+                        break
+
+        if stats["total"] > budget:
+            if stored:
+                self.store.discard(stored)
+            self.forget(messages)
+            raise ContextTooLargeError(
+                f"上下文约 {stats['total']} tokens（system {stats['system']} / "
+                f"tools {stats['tools']} / messages {stats['messages']}），"
+                f"超出预算 {budget} tokens"
+            )
+
+        messages[:] = candidate
+        self.forget(messages)
+        return stats
+
+
+def _compact_tool_results(message: dict, store=None, stored: list = None):
+    """
+    把消息里的 tool_result 内容替换为占位文字；没有可压缩内容时返回 None
+
+    有 store 时原文先存进 store，handle 追加到 stored 并写进占位文字
+    """
+    content = message["content"]
+    if message["role"] != "user" or isinstance(content, str):
+        return None
+
+    changed = False
+    new_content = []
+    for block in content:
+        if (isinstance(block, dict) and block.get("type") == "tool_result"
+                and not str(block.get("content", "")).startswith(_COMPACTED_PREFIX)):
+            text = _block_text(block)
+            if store is None or len(text) > MIN_COMPACT_CHARS:
+                block = {**block, "content": _placeholder(text, store, stored)}
+                changed = True
+        new_content.append(block)
+
+    # 生成新的消息对象，不修改原对象（原对象的缓存仍然有效）
+    return {**message, "content": new_content} if changed else None
+
+
+def _placeholder(text: str, store, stored: list) -> str:
+    if store is None:
+        return COMPACTED_PLACEHOLDER
+    handle = store.store(text)
+    stored.append(handle)
+    return (
+        f"{_COMPACTED_PREFIX}，原结果已存储，handle={handle}，共 {text.count(chr(10)) + 1} 行。"
+        f"如需查看请调用 fetch_result(handle=\"{handle}\", start_line=..., end_line=...)]"
+    )
+
+
+def _turn_starts(messages: list) -> list:
+    """
+    返回每一轮对话（除第一轮外）起始消息的下标
+
+    一轮从用户的纯文字消息开始。紧跟在 assistant 纯文字消息后面的 user 消息
+    （计划之后的"请执行"）属于同一轮，不算新一轮的开始，
+    这样丢弃时任务、计划和执行过程总是一起丢弃，tool_use / tool_result 也保持成对
+    """
+    return [
+        i for i in range(1, len(messages))
+        if messages[i]["role"] == "user" and isinstance(messages[i]["content"], str)
+        and not (messages[i - 1]["role"] == "assistant" and isinstance(messages[i - 1]["content"], str))
+    ]
@@ -20,6 +20,10 @@ import os
 # 存储所有注册的工具
 _tool_registry = {}
 
+# 预先算好的 schema 元组（不可变），注册新工具时失效
+# get_all_tools() 每次调用 LLM 都会用到，不再每次重建列表
+_schema_cache = None
+
 
 def tool(name: str, description: str, params: dict):
     """
@@ -57,10 +61,12 @@ def tool(name: str, description: str, params: dict):
         }
 
         # 注册到全局注册表
+        global _schema_cache
         _tool_registry[name] = {
             "schema": schema,
             "function": func
         }
+        _schema_cache = None
 
         return func
 
@@ -117,11 +123,8 @@ def write_file(path: str, content: str) -> str:
     """写入文件"""
     try:
         # ⭐ 核心竞争力 ⑨ Safety & Guardrails
-        print(f"\n  [安全确认] 即将写入文件: {path}")
-        print(f"  内容预览: {content[:100]}{'...' if len(content) > 100 else ''}")
-        confirm = input("  确认写入? (y/n): ").strip().lower()
-        if confirm != "y":
-            return "用户拒绝写入该文件"
+        # 确认已前移到 agent.py：执行前由 ApprovalPolicy 统一审批（见 approval.py）
+        # 工具线程里不再调用 input()，并行工具不会互相阻塞
 
         dir_name = os.path.dirname(path)
         if dir_name:
@@ -178,8 +181,6 @@ def list_files(path: str = ".") -> str:
 #    生产环境需要：沙箱、命令白名单、权限控制、审计日志
 # ============================================================
 
-import subprocess
-
 
 @tool(
     name="execute_code",
@@ -198,13 +199,11 @@ import subprocess
 )
 def execute_code(command: str, timeout: int = 30) -> str:
     """执行命令行命令"""
+    import subprocess  # 延迟导入：只有真正执行命令时才需要
+
     try:
         # ⭐ 核心竞争力 ⑨ Safety & Guardrails
-        # 执行前让用户确认，防止危险操作
-        print(f"\n  [安全确认] 即将执行命令: {command}")
-        confirm = input("  确认执行? (y/n): ").strip().lower()
-        if confirm != "y":
-            return "用户拒绝执行该命令"
+        # 执行前的确认由 ApprovalPolicy 统一处理（见 approval.py）
 
         # 设置 UTF-8 编码，解决 Windows 中文输出问题
         env = os.environ.copy()
@@ -256,18 +255,65 @@ def execute_code(command: str, timeout: int = 30) -> str:
 )
 def delegate_to_subagent(task: str) -> str:
     """委托任务给 Sub-agent，返回结果"""
-    from subagent import SubAgent  # 延迟导入，避免循环导入
+    from subagent import SubAgent, SubAgentIncompleteError  # 延迟导入，避免循环导入
     agent = SubAgent(max_turns=5)
-    return agent.run(task)
+    try:
+        return agent.run(task)
+    except SubAgentIncompleteError as e:
+        return f"Sub-agent 未完成任务：{str(e)}"
+
+
+# ============================================================
+# 新增：分页读取已存储的大结果
+#
+# ⭐ 核心竞争力 ① Context Management
+#    超过阈值的工具结果不进对话历史，只留摘要 + handle
+#    LLM 需要细节时用这个工具按行分页读取
+# ============================================================
+
+@tool(
+    name="fetch_result",
+    description="分页读取之前因过大而被存储的工具结果。当工具结果中出现 handle=rN 的提示且你需要查看更多内容时使用。每次最多返回 200 行。",
+    params={
+        "handle": {
+            "type": "string",
+            "description": "结果的 handle，例如 'r1'"
+        },
+        "start_line": {
+            "type": "integer",
+            "description": "起始行号（从 1 开始），默认 1",
+            "optional": True
+        },
+        "end_line": {
+            "type": "integer",
+            "description": "结束行号（包含），默认起始行之后 200 行",
+            "optional": True
+        }
+    }
+)
+def fetch_result(handle: str, start_line: int = 1, end_line: int = None) -> str:
+    """从结果存储中读取指定行范围"""
+    try:
+        from result_store import default_store
+
+        # LLM 可能把行号传成字符串（如 "5"），统一转成 int
+        start_line = int(start_line)
+        end_line = int(end_line) if end_line is not None else None
+        return default_store.fetch(str(handle), start_line, end_line)
+    except Exception as e:
+        return f"读取结果失败：{str(e)}"
 
 
 # ============================================================
 # 对外接口（给 agent.py 用的）
 # ============================================================
 
-def get_all_tools() -> list:
-    """获取所有工具的 schema 列表（传给 LLM）"""
-    return [entry["schema"] for entry in _tool_registry.values()]
+def get_all_tools() -> tuple:
+    """获取所有工具的 schema（传给 LLM），返回预先算好的不可变元组"""
+    global _schema_cache
+    if _schema_cache is None:
+        _schema_cache = tuple(entry["schema"] for entry in _tool_registry.values())
+    return _schema_cache
 
 
 def execute_tool(tool_name: str, tool_input: dict) -> str: